@@ -10,8 +10,6 @@ commands = [
     "vignettes",
 ]
 
-COMMANDS = [importlib.import_module("cenfind.cli." + c) for c in commands]
-
 
 def add_command_default(parser):
     class default_command:
@@ -45,7 +43,9 @@ def make_parser():
 
     add_command_default(parser)
     subparsers = parser.add_subparsers()
-    add_command_subparsers(subparsers, COMMANDS)
+    # The commands are imported here rather than with the package, so that processes importing
+    # cenfind, e.g. the vignette workers, do not load TensorFlow and the detection models
+    add_command_subparsers(subparsers, [importlib.import_module("cenfind.cli." + c) for c in commands])
 
     return parser
 
@@ -1,14 +1,18 @@
 import argparse
 import logging
 import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import List, Tuple
 
 import pandas as pd
 import tensorflow as tf
 from tqdm import tqdm
 
-from cenfind.core.data import Dataset
-from cenfind.core.detectors import extract_foci, extract_nuclei, extract_cilia
+from cenfind.core.data import Dataset, Field
+from cenfind.core.detectors import extract_foci_batch, extract_nuclei, extract_cilia, get_model, get_stardist
 from cenfind.core.measure import Assigner
 from cenfind.core.serialise import (
     save_points,
@@ -58,43 +62,72 @@ def register_parser(parent_subparsers):
     )
 
     parser.add_argument("--cpu", action="store_true", help="Only use the cpu")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of fields processed concurrently (default: 1)",
+    )
+    parser.add_argument(
+        "--batch_fields",
+        type=int,
+        default=4,
+        help="Number of fields scored together; their centriole channels go through SpotNet "
+             "in batches of this many images (default: 4)",
+    )
+    parser.add_argument(
+        "--visualisation_format",
+        choices=["png", "jpg"],
+        default="png",
+        help="Image format of the visualisations; jpg is lossy but faster to write (default: png)",
+    )
+    parser.add_argument(
+        "--mixed_precision",
+        action="store_true",
+        help="Run the networks in float16 on the GPU (mixed precision)",
+    )
 
     return parser
 
 
-def run(args):
-    if (args.channel_centrioles is None) and (args.channel_cilia is None):
-        raise ValueError("Please specify at least one channel to evaluate.")
+def score_fields(fields: List[Field], dataset: Dataset, args, model_stardist,
+                 inference: threading.Lock) -> Tuple[dict, List[pd.DataFrame]]:
+    """
+    Detects, assigns and draws the nuclei, centrioles and cilia of a group of fields.
 
-    dataset = Dataset(args.dataset)
-    dataset.setup()
+    The centriole channels of all the fields of the group go through SpotNet in batches of
+    --batch_fields images; StarDist segments the nuclei one field at a time.
 
-    pbar = tqdm(dataset.fields)
+    Args:
+        fields: Fields to score.
+        dataset: Dataset the predictions are saved in.
+        args: Parsed command line arguments.
+        model_stardist: StarDist model instance.
+        inference: Lock held only while the networks predict, so that groups processed in parallel share the device
+            while their images are read, normalised and post-processed concurrently.
 
-    logger.info("Num GPUs Available: %s" % len(tf.config.list_physical_devices('GPU')))
+    Returns: Results per (field name, channel) and the cilia records of the fields.
 
-    if args.cpu:
-        logger.info("Using only CPU")
-        os.environ["CUDA_VISIBLE_DEVICES"] = "-1"
-
-    ciliated_container = []
+    """
     results = {}
+    ciliated = []
 
-    for field in pbar:
+    fields_channels = []
+    for field in fields:
         logger.info("Processing field %s" % field.name)
-        pbar.set_description(f"{field.name}")
 
-        if field.data.ndim != 3:
-            logger.error("Image (%s) is not in CXY format (Actual shape: %s)" % (field.name, field.data.shape))
+        shape = field.shape
+        if len(shape) != 3:
+            logger.error("Image (%s) is not in CXY format (Actual shape: %s)" % (field.name, shape))
             continue
 
-        channels_actual = set(range(field.data.shape[0]))
+        channels_actual = set(range(shape[0]))
 
         channel_centrioles = set(args.channel_centrioles)
         if not channel_centrioles.issubset(channels_actual):
             logger.warning(
                 "Channel %s is beyond the channel span (%s) (Field shape: %s). It has been dismissed" % (
-                    channel_centrioles.difference(channels_actual), list(range(field.data.shape[0])), field.data.shape))
+                    channel_centrioles.difference(channels_actual), list(range(shape[0])), shape))
             channel_centrioles = list(channel_centrioles.intersection(channels_actual))
         else:
             channel_centrioles = list(channel_centrioles)
@@ -103,59 +136,146 @@ def run(args):
             logger.warning(
                 "channel index (%s) for nuclei not in channel span (%s)" % (args.channel_nuclei, channels_actual))
 
-        nuclei = extract_nuclei(field, args.channel_nuclei)
+        fields_channels.append((field, channel_centrioles))
+
+    nuclei_fields = [extract_nuclei(field, args.channel_nuclei, model=model_stardist, inference=inference)
+                     for field, _ in fields_channels]
+    pairs = [(field, channel)
+             for (field, channels), nuclei in zip(fields_channels, nuclei_fields) if nuclei
+             for channel in channels]
+    foci = extract_foci_batch(pairs, foci_model_file=args.model, batch_size=max(1, args.batch_fields),
+                              inference=inference)
+    foci_pairs = {(field.name, channel): centrioles for (field, channel), centrioles in zip(pairs, foci)}
+
+    for (field, channel_centrioles), nuclei in zip(fields_channels, nuclei_fields):
         if len(nuclei) == 0:
             logger.warning("No nuclei in %s" % field.name)
             continue
         save_contours(dataset.nuclei / f"{field.name}_C{args.channel_nuclei}.json", nuclei)
 
-        pbar_dict = {"nuclei": len(nuclei)}
-        if channel_centrioles is not None:
-            for channel in channel_centrioles:
-                pbar_dict["channel"] = channel
-                centrioles = extract_foci(field=field, channel=channel, foci_model_file=args.model)
-                assignment = Assigner(centrioles, nuclei, vicinity=args.vicinity)
-                centrioles_nuclei = assignment.assign_centrioles()
-                scores = assignment.score_nuclei(field.name, channel)
-
-                background = create_vignette(field, marker_index=channel, nuclei_index=args.channel_nuclei)
-                vis = visualisation(background, centrioles=centrioles, nuclei=nuclei, assigned=assignment.assignment)
-
-                results[(field.name, channel)] = {
-                    'scores': scores,
-                    'assignment': assignment.assignment,
-                    'centrioles_nuclei': centrioles_nuclei,
-                    'centrioles': centrioles,
-                    'nuclei': nuclei,
-                    'visualisation': vis}
-
-                pbar_dict[f"centrioles"] = len(centrioles)
-                pbar.set_postfix(pbar_dict)
+        for channel in channel_centrioles:
+            centrioles = foci_pairs[(field.name, channel)]
+            assignment = Assigner(centrioles, nuclei, vicinity=args.vicinity)
+            centrioles_nuclei = assignment.assign_centrioles()
+            scores = assignment.score_nuclei(field.name, channel)
+
+            background = create_vignette(field, marker_index=channel, nuclei_index=args.channel_nuclei)
+            vis = visualisation(background, centrioles=centrioles, nuclei=nuclei, assigned=assignment.assignment)
+
+            results[(field.name, channel)] = {
+                'scores': scores,
+                'assignment': assignment.assignment,
+                'centrioles_nuclei': centrioles_nuclei,
+                'centrioles': centrioles,
+                'nuclei': nuclei,
+                'visualisation': vis}
 
         if args.channel_cilia is not None:
             channel = args.channel_cilia
             ciliae = extract_cilia(field, channel=channel)
             record = proportion_cilia(field, ciliae, nuclei, channel)
-            ciliated_container.append(record)
+            ciliated.append(record)
 
             save_points(dataset.cilia / f"{field.name}_C{channel}.tsv",
                         ciliae)
 
-            pbar_dict["cilia"] = len(ciliae)
-            pbar.set_postfix(pbar_dict)
+    return results, ciliated
+
+
+def save_results(dataset: Dataset, field_name: str, channel: int, data: dict, image_format: str = "png") -> None:
+    """
+    Writes the centrioles, the assignment and the visualisation of one (field, channel).
+
+    Args:
+        dataset: Dataset the predictions are saved in.
+        field_name: Name of the field.
+        channel: Channel of the centrioles.
+        data: Results of the field and channel, as returned by score_fields.
+        image_format: Extension of the visualisation, png or jpg.
+
+    """
+    save_points(dataset.centrioles / f"{field_name}_C{channel}.tsv", data['centrioles'])
+    save_assigned(dataset.assignment / f"{field_name}_C{channel}_matrix.txt", data['assignment'])
+    if data['centrioles_nuclei']:
+        save_assigned_centrioles(dataset.statistics / f"{field_name}_C{channel}_assigned.tsv",
+                                 data['centrioles_nuclei'])
+    save_visualisation(dataset.visualisation / f"{field_name}_C{channel}.{image_format}", data['visualisation'])
 
-    for (field, channel), data in results.items():
-        save_points(dataset.centrioles / f"{field}_C{channel}.tsv", data['centrioles'])
-        save_assigned(dataset.assignment / f"{field}_C{channel}_matrix.txt", data['assignment'])
-        if data['centrioles_nuclei']:
-            save_assigned_centrioles(dataset.statistics / f"{field}_C{channel}_assigned.tsv", data['centrioles_nuclei'])
-        save_visualisation(dataset.visualisation / f"{field}_C{channel}.png", data['visualisation'])
 
-    if not results and args.channel_centrioles:
+def run(args):
+    if (args.channel_centrioles is None) and (args.channel_cilia is None):
+        raise ValueError("Please specify at least one channel to evaluate.")
+
+    dataset = Dataset(args.dataset)
+    dataset.setup()
+
+    logger.info("Num GPUs Available: %s" % len(tf.config.list_physical_devices('GPU')))
+
+    if args.cpu:
+        logger.info("Using only CPU")
+        os.environ["CUDA_VISIBLE_DEVICES"] = "-1"
+
+    if args.mixed_precision:
+        if args.cpu or not tf.config.list_physical_devices('GPU'):
+            logger.warning("Mixed precision requires a GPU; running in float32")
+        else:
+            logger.info("Using mixed precision")
+            tf.keras.mixed_precision.set_global_policy("mixed_float16")
+
+    model_stardist = get_stardist()
+    if args.channel_centrioles:
+        get_model(args.model)
+
+    ciliated_container = []
+    scores = []
+    image_format = args.visualisation_format
+
+    # Reading, normalising, post-processing, drawing and writing overlap across groups while the networks
+    # run one prediction at a time; the results of a group are written in the background as soon as it is scored.
+    # At most `workers` groups are scheduled ahead of the one being collected and at most
+    # `max_pending_writes` results wait for the writer, which bounds the memory of the pipeline.
+    # The fields are handed out group by group and no other reference is kept, so the planes
+    # cached by a field are freed once its results are written.
+    inference = threading.Lock()
+    fields = deque(dataset.fields)
+    num_fields = len(fields)
+    size = max(1, args.batch_fields)
+    workers = max(1, args.workers)
+    max_pending_writes = 4
+    with ThreadPoolExecutor(max_workers=workers) as executor, \
+            ThreadPoolExecutor(max_workers=2) as writer, \
+            tqdm(total=num_fields) as pbar:
+        scoring = deque()
+        writes = deque()
+
+        def collect():
+            group, future = scoring.popleft()
+            pbar.set_description(f"{group[-1].name}")
+            group_results, group_ciliated = future.result()
+            for (field_name, channel), data in group_results.items():
+                while len(writes) >= max_pending_writes:
+                    writes.popleft().result()
+                writes.append(writer.submit(save_results, dataset, field_name, channel, data, image_format))
+                scores.append(data['scores'])
+            ciliated_container.extend(group_ciliated)
+            pbar.update(len(group))
+
+        while fields:
+            group = [fields.popleft() for _ in range(min(size, len(fields)))]
+            scoring.append((group, executor.submit(score_fields, group, dataset, args, model_stardist, inference)))
+            if len(scoring) > workers:
+                collect()
+        while scoring:
+            collect()
+
+        for write in writes:
+            write.result()
+
+    if not scores and args.channel_centrioles:
         raise ValueError("No centriole was detected in the dataset %s." % dataset.path)
 
-    if results:
-        scores_all = pd.concat([v['scores'] for v in results.values()])
+    if scores:
+        scores_all = pd.concat(scores)
         binned = frequency(scores_all)
         binned.to_csv(dataset.statistics / "statistics.tsv", sep="\t", index=True)
 
@@ -173,6 +293,10 @@ if __name__ == "__main__":
                               channel_cilia=None,
                               vicinity=50,
                               cpu=False,
+                              workers=1,
+                              batch_fields=4,
+                              visualisation_format="png",
+                              mixed_precision=False,
                               )
 
     for folder in ("logs", "predictions", "statistics", "vignettes", "visualisation"):
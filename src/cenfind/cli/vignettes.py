@@ -1,10 +1,15 @@
 import argparse
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
+from typing import List
 
 import cv2
 from tqdm import tqdm
 
-from cenfind.core.data import Dataset
+from cenfind.core.data import Dataset, Field
 from cenfind.core.visualisation import create_vignette
 
 
@@ -36,31 +41,71 @@ def register_parser(parent_subparsers):
         default="",
         help="the suffix indicating projection, e.g., `_max` or `_Projected`, empty if not specified",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="the number of processes writing vignettes in parallel",
+    )
 
     return parser
 
 
+def write_vignettes(field: Field, destination: Path, channels: List[int], channel_nuclei: int,
+                    suffix: str = "") -> str:
+    """
+    Writes the vignette of each channel of a field.
+
+    Args:
+        field: Field to draw
+        destination: Folder of the vignettes
+        channels: Channels to draw in green
+        channel_nuclei: Channel of the nuclei, drawn in blue
+        suffix: Suffix indicating the projection
+
+    Returns: The field name
+
+    """
+    for channel_id in channels:
+        vignette = create_vignette(field, channel_id, channel_nuclei)
+        dst = destination / f"{field.name}{suffix}_C{channel_id}.png"
+        cv2.imwrite(str(dst), vignette)
+
+    return field.name
+
+
 def run(args):
     dataset = Dataset(args.dataset)
     path_vignettes = dataset.path / "vignettes"
     path_vignettes.mkdir(exist_ok=True)
 
-    pbar = tqdm(dataset.fields)
-    for field in pbar:
-        for channel_id in args.channel_centrioles:
-            pbar.set_description(f"{field.name}: {channel_id}")
-            vignette = create_vignette(field, channel_id, args.channel_nuclei)
-            dst = (
-                    dataset.path / "vignettes"
-                    / f"{field.name}{args.projection_suffix}_C{channel_id}.png"
-            )
-            cv2.imwrite(str(dst), vignette)
+    fields = dataset.fields
+    write = partial(write_vignettes,
+                    destination=path_vignettes,
+                    channels=args.channel_centrioles,
+                    channel_nuclei=args.channel_nuclei,
+                    suffix=args.projection_suffix)
+
+    # Each field is read, rescaled and encoded independently; a single worker runs inline and
+    # the processes are spawned rather than forked, so they do not inherit the parent's threads
+    with contextlib.ExitStack() as stack:
+        if args.workers > 1:
+            executor = stack.enter_context(ProcessPoolExecutor(max_workers=args.workers,
+                                                               mp_context=multiprocessing.get_context("spawn")))
+            names = executor.map(write, fields)
+        else:
+            names = map(write, fields)
+
+        pbar = tqdm(names, total=len(fields))
+        for name in pbar:
+            pbar.set_description(name)
 
 
 if __name__ == "__main__":
     args = argparse.Namespace(dataset=Path('../../../data/dataset_test'),
                               channel_nuclei=0,
                               channel_centrioles=[1, 2, 3],
-                              projection_suffix='_max'
+                              projection_suffix='_max',
+                              workers=1,
                               )
     run(args)
@@ -41,7 +41,7 @@ celltype_names = {
 }
 
 pattern_dataset = re.compile(
-    "(?P<cell_type>[a-zA-Z0-9.-]+)([+_](?P<treatment>\w+))?_(?P<markers>[\w+]+)_(?P<replicate>\d)"
+    r"(?P<cell_type>[a-zA-Z0-9.-]+)([+_](?P<treatment>\w+))?_(?P<markers>[\w+]+)_(?P<replicate>\d)"
 )
 
 UNITS = {"well", "field"}
@@ -1,5 +1,6 @@
 import itertools
 import logging
+import os
 import random
 from pathlib import Path
 from typing import List, Tuple
@@ -39,6 +40,9 @@ class Field:
     """
 
     path: Path = field(validator=[validators.instance_of(Path), path_exists, is_tif])
+    _data: np.ndarray = field(init=False, default=None, eq=False, repr=False)
+    _shape: Tuple[int, ...] = field(init=False, default=None, eq=False, repr=False)
+    _planes: dict = field(init=False, factory=dict, eq=False, repr=False)
 
     @property
     def name(self) -> str:
@@ -50,9 +54,63 @@ class Field:
     @property
     def data(self) -> np.ndarray:
         """
-        Loads data from path as a numpy array using `tifffile.imread`.
+        Loads data from path as a numpy array, once.
+
+        Uncompressed images are memory-mapped read-only so that only the pixels used are read;
+        other images are loaded with `tifffile.imread`.
         """
-        return tf.imread(str(self.path))
+        if self._data is None:
+            try:
+                self._data = tf.memmap(str(self.path), mode="r")
+            except ValueError:
+                self._data = tf.imread(str(self.path))
+        return self._data
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        """
+        Reads the shape of the image from the file metadata without loading the pixels.
+        """
+        if self._shape is None:
+            if self._data is not None:
+                self._shape = self._data.shape
+            else:
+                with tf.TiffFile(str(self.path)) as file:
+                    self._shape = file.series[0].shape
+        return self._shape
+
+    def channel(self, index: int) -> np.ndarray:
+        """
+        Loads one channel of a CXY image, once.
+
+        Only the page holding the channel is read when each channel is stored as a page,
+        unless the whole image is already loaded. The plane is kept for the next calls, so
+        it is returned read-only, and C-contiguous as expected by the detectors.
+
+        Args:
+            index: the channel index
+        Returns:
+            the channel as a 2D array
+        """
+        if index not in self._planes:
+            plane = np.ascontiguousarray(self._read_channel(index))
+            plane.flags.writeable = False
+            self._planes[index] = plane
+        return self._planes[index]
+
+    def _read_channel(self, index: int) -> np.ndarray:
+        """
+        Reads one channel from the loaded image or, if not loaded, from its page in the file.
+        """
+        if self._data is not None:
+            return self._data[index, ...]
+
+        with tf.TiffFile(str(self.path)) as file:
+            series = file.series[0]
+            if len(series.shape) == 3 and len(series.pages) == series.shape[0]:
+                return file.asarray(key=index, series=0)
+
+        return self.data[index, ...]
 
 
 @define
@@ -69,6 +127,7 @@ class Dataset:
         validators.instance_of(Path),
         path_exists,
         has_projections])
+    _paths: List[Path] = field(init=False, default=None, eq=False, repr=False)
 
     @property
     def logs(self):
@@ -131,17 +190,23 @@ class Dataset:
     def fields(self) -> List[Field]:
         """
         Collects all Fields found in `projections` into a list and raises a ValueError if no TIF file.
+
+        The directory is listed once; each call returns new Fields, so that the pixels
+        loaded by a field are freed with it rather than kept by the Dataset.
         """
 
-        result = []
-        for path in self.projections.iterdir():
-            if (path.suffix == '.tif') and not path.name.startswith("."):
-                result.append(Field(path))
+        if self._paths is None:
+            paths = []
+            with os.scandir(self.projections) as entries:
+                for entry in entries:
+                    if entry.name.endswith(".tif") and not entry.name.startswith(".") and entry.is_file():
+                        paths.append(Path(entry.path))
 
-        if len(result) == 0:
-            raise ValueError(f"No field found in {self.projections}")
+            if len(paths) == 0:
+                raise ValueError(f"No field found in {self.projections}")
+            self._paths = paths
 
-        return result
+        return [Field(path) for path in self._paths]
 
     def split_pairs(self, channels: Tuple[int], p=0.9, seed=1993) -> tuple[list[tuple[Field, int]], list[tuple[Field, int]]]:
         """
@@ -156,11 +221,12 @@ class Dataset:
         """
         random.seed(seed)
 
-        size = len(self.fields)
+        fields = self.fields
+        size = len(fields)
         split_idx = int(p * size)
         _channels = random.choices(channels, k=size)
 
-        pairs = [(field, int(channel)) for field, channel in zip(self.fields, _channels)]
+        pairs = [(field, int(channel)) for field, channel in zip(fields, _channels)]
 
         shuffled = random.sample(pairs, k=size)
         split_train = shuffled[:split_idx]
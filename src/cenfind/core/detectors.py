@@ -3,23 +3,24 @@ import functools
 import logging
 import os
 from pathlib import Path
-from typing import List
+from typing import ContextManager, List, Tuple
 
 import cv2
 import numpy as np
 import tensorflow as tf
-from csbdeep.utils import normalize
+from scipy import ndimage
 from skimage import measure
 from skimage.exposure import rescale_intensity
 from skimage.feature import hessian_matrix, hessian_matrix_eigvals
 from skimage.filters.thresholding import threshold_otsu
+from skimage.util import img_as_float32
 from spotipy.model import SpotNet
-from spotipy.utils import normalize_fast2d
+from spotipy.utils import prob_to_points
 from stardist.models import StarDist2D
 
 from cenfind.core.data import Field
 from cenfind.core.structures import Centriole, Nucleus
-from cenfind.core.visualisation import draw_foci, resize_image
+from cenfind.core.visualisation import draw_disks, resize_image
 
 np.random.seed(1)
 tf.random.set_seed(2)
@@ -30,6 +31,108 @@ os.environ["TF_CPP_MIN_LOG_LEVEL"] = "3"
 logger = logging.getLogger(__name__)
 
 
+@functools.lru_cache(maxsize=None)
+def _devnull():
+    """
+    Opens the null device once; the models print to stdout, which is redirected there.
+    """
+    return open(os.devnull, "w")
+
+
+@functools.lru_cache(maxsize=None)
+def get_model(model: Path) -> SpotNet:
+    """
+    Loads the SpotNet model once per model path.
+
+    :param model: Path to the SpotNet model folder.
+    :return: SpotNet model instance.
+    """
+    path = Path(model)
+    if not path.is_dir():
+        raise (FileNotFoundError(f"{path} is not a directory"))
+
+    with contextlib.redirect_stdout(_devnull()):
+        return SpotNet(None, name=path.name, basedir=str(path.parent))
+
+
+@functools.lru_cache(maxsize=None)
+def get_stardist(name: str = "2D_versatile_fluo") -> StarDist2D:
+    """
+    Loads a pretrained StarDist model once per name.
+
+    :param name: Name of the pretrained model (default: 2D_versatile_fluo).
+    :return: StarDist model instance.
+    """
+    with contextlib.redirect_stdout(_devnull()):
+        return StarDist2D.from_pretrained(name)
+
+
+def normalize_percentiles(image: np.ndarray, pmin: float = 1, pmax: float = 99.8, sub: int = 1,
+                          eps: float = 1e-20, out: np.ndarray = None) -> np.ndarray:
+    """
+    Rescales the intensities so that the percentiles pmin and pmax map to 0 and 1.
+
+    Same arithmetic as spotipy's normalize_fast2d, but 8- and 16-bit images larger than their
+    range are mapped through a lookup table holding the value of every intensity level.
+
+    :param image: Single channel image.
+    :param pmin: Lower percentile (default: 1).
+    :param pmax: Upper percentile (default: 99.8).
+    :param sub: Subsampling step used to estimate the percentiles (default: 1).
+    :param eps: Added to the range to avoid dividing by zero (default: 1e-20, as spotipy and csbdeep).
+    :param out: Optional float32 array of the image shape receiving the result.
+    :return: Normalised float32 image.
+    """
+    mi, ma = np.percentile(image[::sub, ::sub], (pmin, pmax))
+    if out is None:
+        out = np.empty(image.shape, dtype=np.float32)
+
+    if image.dtype in (np.uint8, np.uint16) and image.size > 2 ** (8 * image.itemsize):
+        levels = np.arange(2 ** (8 * image.itemsize), dtype=np.float32)
+        table = ((levels - mi) / (ma - mi + eps)).astype(np.float32)
+        # Indices always fall within the table; mode="clip" lets np.take write into out unbuffered
+        return np.take(table, image, out=out, mode="clip")
+
+    out[...] = (image.astype(np.float32, copy=False) - mi) / (ma - mi + eps)
+    return out
+
+
+def _centrioles_from_points(field: Field, channel: int, points: np.ndarray,
+                            shape: Tuple[int, int], min_distance=2) -> List[Centriole]:
+    """
+    Wraps the detected points into centrioles and ties neighbouring centrioles into centrosomes.
+
+    :param field: Field of view the points were detected in.
+    :param channel: Channel used for the detection.
+    :param points: Detected points as (row, col) positions.
+    :param shape: Shape of the image used for the detection.
+    :param min_distance: Minimal distance between two centrioles (default: 2 pixels).
+    :return: List of centriole objects.
+    """
+    points = np.asarray(points, dtype=int).reshape(-1, 2)
+
+    # The centrosomes are found on the positions, the objects are only built at the end
+    centrosomes_mask = draw_disks(shape, points, radius=min_distance * 2)
+    _, centrosomes_map, _, centrosomes_centroids = cv2.connectedComponentsWithStats(centrosomes_mask, connectivity=8)
+    centrosomes_ids = centrosomes_map[points[:, 0], points[:, 1]]
+
+    # The centroids are (x, y); one slice turns them into (row, col)
+    centrosomes_centres = centrosomes_centroids[:, ::-1]
+    centrosomes = {foci_index: Centriole(field=field, channel=channel,
+                                         centre=tuple(centrosomes_centres[foci_index]), label="Centrosome")
+                   for foci_index in np.unique(centrosomes_ids).tolist()}
+
+    foci = [Centriole(field=field, channel=channel, centre=tuple(centre), index=f_id, label="Centriole",
+                      parent=centrosomes[foci_index])
+            for f_id, (centre, foci_index) in enumerate(zip(points.tolist(), centrosomes_ids.tolist()))]
+
+    if len(foci) == 0:
+        logger.warning("No centrioles (channel: %s) has been detected in %s" % (channel, field.name))
+
+    logger.info("(%s), channel %s: foci: %s" % (field.name, channel, len(foci)))
+    return foci
+
+
 def extract_foci(field: Field, channel: int, foci_model_file: Path,
                  prob_threshold=0.5, min_distance=2, ) -> List[Centriole]:
     """
@@ -42,93 +145,146 @@ def extract_foci(field: Field, channel: int, foci_model_file: Path,
     :param min_distance: Minimal distance between two centrioles (default: 2 pixels).
     :return: List of centriole objects.
     """
-    logger.info("Processing %s / %d" % (field.name, channel))
-    if field.data.ndim != 3:
-        raise ValueError("Bad data shape: %s; Ensure that the image is CXY" % field.data.shape)
-    data = field.data[channel, ...]
+    return extract_foci_batch([(field, channel)], foci_model_file,
+                              prob_threshold=prob_threshold, min_distance=min_distance)[0]
 
-    @functools.lru_cache(maxsize=None)
-    def get_model(model):
-        path = Path(model)
-        if not path.is_dir():
-            raise (FileNotFoundError(f"{path} is not a directory"))
-
-        return SpotNet(None, name=path.name, basedir=str(path.parent))
 
-    with open(os.devnull, "w") as f, contextlib.redirect_stdout(f):
-        data = normalize_fast2d(data)
-        model = get_model(foci_model_file)
-        _, points_preds = model.predict(
-            data, prob_thresh=prob_threshold, min_distance=min_distance, verbose=False
-        )
+def extract_foci_batch(pairs: List[Tuple[Field, int]], foci_model_file: Path,
+                       prob_threshold=0.5, min_distance=2, batch_size=4,
+                       inference: ContextManager = None) -> List[List[Centriole]]:
+    """
+    Detects centrioles in several (field, channel) pairs, running SpotNet on batches.
 
-    foci = []
-    for f_id, (r, c) in enumerate(points_preds.tolist()):
-        foci.append(Centriole(field=field, channel=channel, centre=(r, c), index=f_id, label="Centriole"))
+    The pairs may come from different fields. Images of the same shape are normalised
+    and stacked, batch_size at a time, so that the network runs on batches instead of
+    one image at a time while the memory stays bounded.
 
-    centrosomes_mask = np.zeros(data.shape, dtype="uint8")
-    centrosomes_mask = draw_foci(centrosomes_mask, foci, radius=min_distance * 2)
+    :param pairs: List of (field, channel) to search for centrioles.
+    :param foci_model_file: SpotNet trained model file.
+    :param prob_threshold: Probability threshold used for the cutoff (default: 0.5).
+    :param min_distance: Minimal distance between two centrioles (default: 2 pixels).
+    :param batch_size: Number of images processed at once by the network (default: 4).
+    :param inference: Context entered only while the network runs, e.g., a lock shared between threads.
+    :return: List of centriole objects for each pair.
+    """
+    if len(pairs) == 0:
+        return []
+    if inference is None:
+        inference = contextlib.nullcontext()
+
+    model = get_model(foci_model_file)
+    div_by = model.config.unet_pool ** model.config.unet_n_depth
+
+    groups = {}
+    for index, (field, _) in enumerate(pairs):
+        field_shape = field.shape
+        if len(field_shape) != 3:
+            raise ValueError("Bad data shape: %s; Ensure that the image is CXY" % (field_shape,))
+        groups.setdefault(tuple(field_shape[-2:]), []).append(index)
+
+    result = [None] * len(pairs)
+    for shape, indices in groups.items():
+        # Same padding as SpotNet.predict: the spatial axes must be divisible by the U-Net pooling
+        pad_shape = tuple(int(div_by * np.ceil(s / div_by)) for s in shape)
+        top, left = ((p - s + 1) // 2 for p, s in zip(pad_shape, shape))
+        crop = slice(top, top + shape[0]), slice(left, left + shape[1])
+
+        images = np.zeros((min(batch_size, len(indices)),) + pad_shape + (1,), dtype=np.float32)
+        for start in range(0, len(indices), batch_size):
+            chunk = indices[start:start + batch_size]
+            batch = images[:len(chunk)]
+
+            # The images are normalised straight into the input batch
+            for image, index in zip(batch, chunk):
+                field, channel = pairs[index]
+                logger.info("Processing %s / %d" % (field.name, channel))
+                normalize_percentiles(field.channel(channel), pmin=1, pmax=99.8, sub=4, out=image[crop + (0,)])
+
+            with inference:
+                probs = model.keras_model.predict_on_batch(batch)
+            if model.config.multiscale:
+                probs = probs[0]
+            probs = np.asarray(probs, dtype=np.float32)
+
+            for index, prob in zip(chunk, probs[..., 0]):
+                field, channel = pairs[index]
+                points_preds = prob_to_points(prob[crop], prob_thresh=prob_threshold, min_distance=min_distance)
+                result[index] = _centrioles_from_points(field, channel, points_preds, shape,
+                                                        min_distance=min_distance)
 
-    centrosomes_map = measure.label(centrosomes_mask)
-    centrosomes_centroids = measure.regionprops(centrosomes_map)
+    return result
 
-    for f in foci:
-        foci_index = centrosomes_map[f.centre]
-        centrosome_centroid = centrosomes_centroids[foci_index - 1].centroid
-        f.parent = Centriole(field=field, channel=channel, centre=centrosome_centroid, label="Centrosome")
 
-    if len(foci) == 0:
-        logger.warning("No centrioles (channel: %s) has been detected in %s" % (channel, field.name))
+def _nearest_indices(src_size: int, dst_size: int) -> np.ndarray:
+    """
+    Source index of each destination pixel when resizing an axis with cv2.INTER_NEAREST.
 
-    logger.info("(%s), channel %s: foci: %s" % (field.name, channel, len(foci)))
-    return foci
+    :param src_size: Size of the axis in the source image.
+    :param dst_size: Size of the axis in the resized image.
+    :return: Non-decreasing source indices (dst_size).
+    """
+    scale = 1.0 / (dst_size / src_size)
+    return np.minimum(np.floor(np.arange(dst_size) * scale).astype(int), src_size - 1)
 
 
-def extract_nuclei(field: Field, channel: int, model: StarDist2D = None) -> List[Nucleus]:
+def extract_nuclei(field: Field, channel: int, model: StarDist2D = None,
+                   factor: int = 256, n_tiles: Tuple[int, int] = None,
+                   inference: ContextManager = None) -> List[Nucleus]:
     """
     Extracts the nuclei from the field.
 
     :param field: Field of view to search for nuclei.
     :param channel: Channel to use in the field.
     :param model: Model instance of StarDist.
+    :param factor: Target dimension of the image segmented by StarDist (default: 256);
+        None segments the image at its native resolution.
+    :param n_tiles: Number of tiles per axis used by StarDist, e.g., (4, 4) at native resolution.
+    :param inference: Context entered only while the network runs, e.g., a lock shared between threads.
 
     :return: List of Nuclei.
 
     """
     if model is None:
-        from stardist.models import StarDist2D
-        with open(os.devnull, "w") as f, contextlib.redirect_stdout(f):
-            model = StarDist2D.from_pretrained("2D_versatile_fluo")
+        model = get_stardist()
+    if inference is None:
+        inference = contextlib.nullcontext()
 
-    if field.data.ndim == 2:
+    ndim = len(field.shape)
+    if ndim == 2:
         data = field.data
-    elif field.data.ndim == 3:
-        data = field.data[channel, ...]
+    elif ndim == 3:
+        data = field.channel(channel)
     else:
-        raise ValueError("Bad data shape: %s; Ensure that the image is CXY" % field.data.shape)
-
-    data_resized = resize_image(data)
-    with open(os.devnull, "w") as f, contextlib.redirect_stdout(f):
-        labels, _ = model.predict_instances(normalize(data_resized))
-    labels = cv2.resize(
-        labels, dsize=data.shape, fx=1, fy=1, interpolation=cv2.INTER_NEAREST
-    )
-
-    if len(labels) == 0:
+        raise ValueError("Bad data shape: %s; Ensure that the image is CXY" % (field.shape,))
+
+    data_resized = data if factor is None else resize_image(data, factor)
+    data_normalised = normalize_percentiles(data_resized, pmin=3, pmax=99.8)
+    with inference, contextlib.redirect_stdout(_devnull()):
+        labels, _ = model.predict_instances(data_normalised, n_tiles=n_tiles)
+    # StarDist numbers the nuclei 1..K, so one max tells whether any was found
+    if labels.max() == 0:
         logger.warning("No nucleus has been detected in %s" % field.name)
         return []
-    labels_id = np.unique(labels)
+
+    # Each nucleus is traced on its bounding box of the labels upsampled to the field,
+    # so the contours are those of the full-size nearest-neighbour label image
+    rows_map = _nearest_indices(labels.shape[0], data.shape[0])
+    cols_map = _nearest_indices(labels.shape[1], data.shape[1])
 
     nuclei = []
-    for nucleus_index, nucleus_label in enumerate(labels_id):
-        if nucleus_label == 0:
+    for nucleus_index, bbox in enumerate(ndimage.find_objects(labels)):
+        if bbox is None:
             continue
-        sub_mask = np.zeros_like(labels, dtype="uint8")
-        sub_mask[labels == nucleus_label] = 1
+        rows, cols = bbox
+        row_start, row_stop = np.searchsorted(rows_map, (rows.start, rows.stop))
+        col_start, col_stop = np.searchsorted(cols_map, (cols.start, cols.stop))
+        sub_labels = labels[rows_map[row_start:row_stop, None], cols_map[None, col_start:col_stop]]
+        sub_mask = (sub_labels == nucleus_index + 1).astype("uint8")
         contour, _ = cv2.findContours(
-            sub_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE
+            sub_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=(int(col_start), int(row_start))
         )
-        nucleus = Nucleus(field=field, channel=channel, contour=contour[0], label="Nucleus", index=nucleus_index - 1)
+        contour = contour[0]
+        nucleus = Nucleus(field=field, channel=channel, contour=contour, label="Nucleus", index=nucleus_index)
         nuclei.append(nucleus)
 
     logger.info("Nuclei extraction (channel %s) in %s: %s" % (channel, field.name, len(nuclei)))
@@ -147,8 +303,10 @@ def extract_cilia(field: Field, channel, sigma=5.0, eccentricity=.9, area=200) -
     :param area: Filter area to use.
     :return: List of cilia Point objects.
     """
-    data = field.data[channel, ...]
+    data = field.channel(channel)
     resc = rescale_intensity(data, out_range="uint8")
+    # skimage would otherwise smooth and differentiate the uint8 image in float64
+    resc = img_as_float32(resc)
 
     h_elems = hessian_matrix(resc, sigma=sigma, order="rc")
     _, minima_ridges = hessian_matrix_eigvals(h_elems)
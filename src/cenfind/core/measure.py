@@ -1,13 +1,12 @@
 from typing import Tuple, List
 
-import cv2
 import numpy as np
 import pandas as pd
 from attrs import define
-from ortools.linear_solver import pywraplp
+from numba import njit
 
 import logging
-from cenfind.core.structures import Centriole, Nucleus
+from cenfind.core.structures import Centriole, Nucleus, positions
 
 logger = logging.getLogger(__name__)
 
@@ -22,19 +21,110 @@ def flag(is_full: bool) -> Tuple[int, int, int]:
     return (0, 255, 0) if is_full else (0, 0, 255)
 
 
-def signed_distance(focus: Centriole, nucleus: Nucleus) -> float:
+@njit(cache=True)
+def _polygon_distances(contour: np.ndarray, points: np.ndarray) -> np.ndarray:
     """
-    Wrapper for the opencv PolygonTest.
+    Computes the signed distances of several points to one contour.
 
-    :param focus: The point to test.
-    :param nucleus: Reference nucleus.
-    :return: Distance in pixel.
+    Follows cv2.pointPolygonTest with measureDist: the distance to the closest
+    edge, positive inside, negative outside and zero on the contour.
+
+    :param contour: Contour as returned by cv2.findContours (N x 1 x 2, XY).
+    :param points: Points as (row, col) positions (F x 2).
+    :return: Distance in pixel for each point.
     """
+    total = contour.shape[0]
+    result = np.empty(points.shape[0])
+    for p in range(points.shape[0]):
+        py = float(points[p, 0])
+        px = float(points[p, 1])
+        min_dist_num = 3.4028234663852886e38
+        min_dist_denom = 1.0
+        counter = 0
+        vx = float(contour[total - 1, 0, 0])
+        vy = float(contour[total - 1, 0, 1])
+        for i in range(total):
+            v0x = vx
+            v0y = vy
+            vx = float(contour[i, 0, 0])
+            vy = float(contour[i, 0, 1])
+            dx = vx - v0x
+            dy = vy - v0y
+            dx1 = px - v0x
+            dy1 = py - v0y
+            dx2 = px - vx
+            dy2 = py - vy
+            dist_denom = 1.0
+            if dx1 * dx + dy1 * dy <= 0:
+                dist_num = dx1 * dx1 + dy1 * dy1
+            elif dx2 * dx + dy2 * dy >= 0:
+                dist_num = dx2 * dx2 + dy2 * dy2
+            else:
+                dist_num = dy1 * dx - dx1 * dy
+                dist_num *= dist_num
+                dist_denom = dx * dx + dy * dy
+
+            if dist_num * min_dist_denom < min_dist_num * dist_denom:
+                min_dist_num = dist_num
+                min_dist_denom = dist_denom
+                if min_dist_num == 0:
+                    break
+
+            if (v0y <= py and vy <= py) or (v0y > py and vy > py) or (v0x < px and vx < px):
+                continue
+
+            dist_num = dy1 * dx - dx1 * dy
+            if dy < 0:
+                dist_num = -dist_num
+            if dist_num > 0:
+                counter += 1
+
+        distance = np.sqrt(min_dist_num / min_dist_denom)
+        if counter % 2 == 0:
+            distance = -distance
+        result[p] = distance
 
-    result = cv2.pointPolygonTest(nucleus.contour, focus.centre_xy, measureDist=True)
     return result
 
 
+@njit(cache=True)
+def _distance_matrix(vertices: np.ndarray, offsets: np.ndarray, points: np.ndarray) -> np.ndarray:
+    """
+    Computes the signed distances of all points to all packed contours.
+
+    :param vertices: Contours concatenated along the first axis (V x 1 x 2, XY).
+    :param offsets: Start of each contour in vertices, followed by the total (N + 1).
+    :param points: Points as (row, col) positions (F x 2).
+    :return: Distance matrix in pixel (N x F).
+    """
+    num_contours = offsets.shape[0] - 1
+    result = np.empty((num_contours, points.shape[0]))
+    for n in range(num_contours):
+        result[n] = _polygon_distances(vertices[offsets[n]:offsets[n + 1]], points)
+
+    return result
+
+
+def signed_distances(centrioles: List[Centriole], nuclei: List[Nucleus]) -> np.ndarray:
+    """
+    Computes the signed distances between all centrioles and all nuclei.
+
+    The contours are packed into one vertex array so that the whole matrix is
+    computed in a single compiled pass.
+
+    :param centrioles: The points to test.
+    :param nuclei: Reference nuclei.
+    :return: Distance matrix in pixel (Nuclei x Centrioles).
+    """
+    if len(nuclei) == 0 or len(centrioles) == 0:
+        return np.full((len(nuclei), len(centrioles)), -np.inf)
+
+    vertices = np.concatenate([n.contour.reshape(-1, 1, 2) for n in nuclei])
+    offsets = np.cumsum([0] + [len(n.contour) for n in nuclei])
+
+    return _distance_matrix(vertices, offsets, positions(centrioles))
+
+
 @define
 class Assigner:
     """
@@ -54,8 +144,13 @@ class Assigner:
 
     def _compute(self, vicinity: float = 0) -> np.ndarray:
         """
-        Computes the assignment using the Google OR-Tool solver
-        for the linear assignment with multiple tasks.
+        Computes the assignment of centrioles to nuclei.
+
+        Each centriole is assigned to at most one nucleus and the objective is the sum
+        of the signed distances shifted by the vicinity. The objective is separable per
+        centriole, so the optimum assigns each centriole to its best nucleus whenever
+        the shifted distance is positive.
+
         Args:
             vicinity: Threshold distance to assign centrioles to nuclei.
 
@@ -65,38 +160,15 @@ class Assigner:
         num_nuclei = len(self.nuclei)
         num_centrioles = len(self.centrioles)
 
-        costs = {}
-        for i in range(num_nuclei):
-            for j in range(num_centrioles):
-                dist = signed_distance(self.centrioles[j], self.nuclei[i])
-                costs[i, j] = dist + vicinity
-        solver = pywraplp.Solver.CreateSolver("SCIP")
-
-        x = {}
-        for i in range(num_nuclei):
-            for j in range(num_centrioles):
-                x[i, j] = solver.IntVar(0, 1, "")
-
-        for j in range(num_centrioles):
-            solver.Add(solver.Sum([x[i, j] for i in range(num_nuclei)]) <= 1)
-
-        # Objective
-        objective_terms = []
-        for i in range(num_nuclei):
-            for j in range(num_centrioles):
-                objective_terms.append(costs[i, j] * x[i, j])
-        solver.Maximize(solver.Sum(objective_terms))
-
-        # Solve
-        status = solver.Solve()
-        if status != pywraplp.Solver.OPTIMAL and status != pywraplp.Solver.FEASIBLE:
-            raise ValueError("No solution found.")
-
         result = np.zeros([num_nuclei, num_centrioles], dtype=bool)
-        for i in range(num_nuclei):
-            for j in range(num_centrioles):
-                if x[i, j].solution_value() > 0:
-                    result[i, j] = True
+        if num_nuclei == 0 or num_centrioles == 0:
+            return result
+
+        costs = signed_distances(self.centrioles, self.nuclei) + vicinity
+        best = costs.argmax(axis=0)
+        columns = np.arange(num_centrioles)
+        assigned = costs[best, columns] > 0
+        result[best[assigned], columns[assigned]] = True
 
         return result
 
@@ -114,11 +186,11 @@ class Assigner:
         if self.assignment is None:
             self.assignment = self._compute(self.vicinity)
 
-        result = self.assignment.sum(axis=1)
-        result = list(zip(self.nuclei, result))
-
-        result = pd.DataFrame(list((n.index, n.full_in_field, s) for n, s in result))
-        result.columns = ["nucleus", "full_in_field", "score"]
+        result = pd.DataFrame({
+            "nucleus": [n.index for n in self.nuclei],
+            "full_in_field": [n.full_in_field for n in self.nuclei],
+            "score": self.assignment.sum(axis=1),
+        })
         result["field"] = field_name
         result["channel"] = channel
         result = result.set_index(["field", "channel"])
@@ -136,15 +208,9 @@ class Assigner:
         if self.assignment is None:
             self.assignment = self._compute(self.vicinity)
 
-        result = []
+        nuclei_indices = [n.index for n in self.nuclei]
+        is_assigned = self.assignment.any(axis=0)
+        nucleus_matrix_indices = self.assignment.argmax(axis=0)
 
-        for c, centriole in enumerate(self.assignment.T):
-            centriole_index = self.centrioles[c].index
-            if np.max(centriole) == 0:
-                result.append((centriole_index, -1))
-            else:
-                nucleus_matrix_index = np.where(centriole == 1)[0][0]
-                nucleus_index = self.nuclei[nucleus_matrix_index].index
-                result.append((centriole_index, nucleus_index))
-
-        return result
+        return [(centriole.index, nuclei_indices[n] if assigned else -1)
+                for centriole, assigned, n in zip(self.centrioles, is_assigned, nucleus_matrix_indices)]
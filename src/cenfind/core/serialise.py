@@ -3,10 +3,10 @@ import logging
 from pathlib import Path
 from typing import List
 
+import cv2
 import numpy as np
 import pandas as pd
-import tifffile as tif
-from cenfind.core.structures import Centriole, Nucleus
+from cenfind.core.structures import Centriole, Nucleus, positions
 
 logger = logging.getLogger(__name__)
 
@@ -59,7 +59,15 @@ def save_points(dst: Path, centrioles: List[Centriole]) -> None:
         result = pd.DataFrame([])
         logger.info("No centriole detected")
     else:
-        result = pd.DataFrame.from_dict({c.index: c.as_dict() for c in centrioles}, orient='index')
+        # Each field reads a plane once and keeps it
+        intensities = [c.intensity(c.field.channel(c.channel), k=1) for c in centrioles]
+        centres = positions(centrioles)
+        result = pd.DataFrame({
+            "channel": [c.channel for c in centrioles],
+            "pos_r": centres[:, 0],
+            "pos_c": centres[:, 1],
+            "intensity": intensities,
+        })
     result.to_csv(dst, index_label="index", index=False, sep='\t')
 
 
@@ -80,14 +88,23 @@ def save_contours(dst: Path, nuclei: List[Nucleus]) -> None:
         logger.info("Writing contours to %s" % str(dst))
 
 
-def save_visualisation(dst: Path, vis: np.ndarray) -> None:
+def save_visualisation(dst: Path, vis: np.ndarray, compression: int = 1, quality: int = 90) -> None:
     """
     Saves the visualisation image.
 
+    The format is inferred from the extension of the destination; JPEG is lossy
+    but much faster to encode than PNG.
+
     Args:
        dst: The destination path.
-       vis: The image.
+       vis: The image (BGR).
+       compression: PNG compression level, from 0 (fastest) to 9 (smallest).
+       quality: JPEG quality, from 0 to 100.
 
     """
     logger.info("Writing visualisation to %s" % (str(dst)))
-    tif.imwrite(dst, vis)
+    if Path(dst).suffix.lower() in (".jpg", ".jpeg"):
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+    else:
+        params = [cv2.IMWRITE_PNG_COMPRESSION, compression]
+    cv2.imwrite(str(dst), vis, params)
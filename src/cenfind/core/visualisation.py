@@ -1,5 +1,6 @@
+import functools
 import logging
-from typing import List
+from typing import List, Tuple
 
 import cv2
 import numpy as np
@@ -7,7 +8,7 @@ from skimage.draw import disk
 from skimage.exposure import rescale_intensity
 
 from cenfind.core.data import Field
-from cenfind.core.structures import Centriole, Nucleus
+from cenfind.core.structures import Centriole, Nucleus, positions
 
 logger = logging.getLogger(__name__)
 
@@ -25,12 +26,13 @@ def resize_image(image: np.ndarray, factor: int = 256) -> np.ndarray:
     """
 
     height, width = image.shape
-    shrinkage_factor = int(height // factor)
+    shrinkage_factor = max(1, int(height // factor))
     height_scaled = int(height // shrinkage_factor)
     width_scaled = int(width // shrinkage_factor)
+    # OpenCV sizes are (width, height); with an integer factor, INTER_AREA is a block average
     data_resized = cv2.resize(image,
-                              dsize=(height_scaled, width_scaled),
-                              fx=1, fy=1, interpolation=cv2.INTER_NEAREST,
+                              dsize=(width_scaled, height_scaled),
+                              interpolation=cv2.INTER_AREA,
                               )
 
     return data_resized
@@ -55,9 +57,9 @@ def draw_point(image: np.ndarray, point: Centriole,
 
     """
     r, c = point.centre
-    offset_col = int(0.01 * image.shape[1])
 
     if annotation:
+        offset_col = int(0.01 * image.shape[1])
         cv2.putText(
             image,
             f"{point.label} {point.index}",
@@ -73,6 +75,53 @@ def draw_point(image: np.ndarray, point: Centriole,
     )
 
 
+@functools.lru_cache(maxsize=None)
+def _disk_offsets(radius: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Computes the pixel offsets of a disk around its centre, once per radius.
+
+    Args:
+        radius: Radius of the disk
+
+    Returns: Row and column offsets (read-only)
+
+    """
+    dr, dc = disk((radius, radius), radius)
+    dr, dc = dr - radius, dc - radius
+    dr.flags.writeable = False
+    dc.flags.writeable = False
+
+    return dr, dc
+
+
+def draw_disks(shape: Tuple[int, ...], centres: np.ndarray, radius=2) -> np.ndarray:
+    """
+    Draws disks of given radius around positions.
+
+    Args:
+        shape: Shape of the mask
+        centres: Positions as (row, col) (N x 2)
+        radius: Radius of the disks
+
+    Returns: The mask image
+
+    """
+    mask = np.zeros(shape, dtype="uint8")
+    if len(centres) == 0:
+        return mask
+
+    # The same disk stamp is splatted at every centre at once
+    dr, dc = _disk_offsets(radius)
+    rr = (centres[:, 0, None] + dr).ravel()
+    cc = (centres[:, 1, None] + dc).ravel()
+
+    height, width = shape[-2:]
+    inside = (rr >= 0) & (rr < height) & (cc >= 0) & (cc < width)
+    mask[rr[inside], cc[inside]] = 250
+
+    return mask
+
+
 def draw_foci(image: np.ndarray, foci: list[Centriole], radius=2) -> np.ndarray:
     """
     Draws foci as disks of given radius.
@@ -87,13 +136,7 @@ def draw_foci(image: np.ndarray, foci: list[Centriole], radius=2) -> np.ndarray:
     Returns: The mask image
 
     """
-
-    mask = np.zeros(image.shape, dtype="uint8")
-    for f in foci:
-        rr, cc = disk(f.centre, radius, shape=image.shape[-2:])
-        mask[rr, cc] = 250
-
-    return mask
+    return draw_disks(image.shape, positions(foci), radius=radius)
 
 
 def draw_contour(image: np.ndarray, nucleus: Nucleus,
@@ -129,34 +172,6 @@ def draw_contour(image: np.ndarray, nucleus: Nucleus,
     return image
 
 
-def _color_channel(image: np.ndarray, color: tuple[int, int, int], out_range: str) -> np.ndarray:
-    """
-    Creates a coloured version of a channel image
-
-    Args:
-        image: Image to convert
-        color: Color to use (B, G, R)
-        out_range: Depth, e.g., 'uint8'
-
-    Returns:
-
-    """
-    """
-
-    :param data: the data to use
-    :param color: the color as a tuple (B, G, R)
-    :param out_range:
-    :return:
-    """
-    data = rescale_intensity(image, out_range=out_range)
-    b = np.multiply(data, color[0], casting="unsafe")
-    g = np.multiply(data, color[1], casting="unsafe")
-    r = np.multiply(data, color[2], casting="unsafe")
-    res = cv2.merge([b, g, r])
-
-    return res
-
-
 def create_vignette(field: Field, marker_index: int, nuclei_index: int) -> np.ndarray:
     """
     Normalises all markers and represent them as blue and highlight the channel in green.
@@ -170,13 +185,12 @@ def create_vignette(field: Field, marker_index: int, nuclei_index: int) -> np.nd
 
     """
 
-    layer_nuclei = field.data[nuclei_index, ...]
-    layer_marker = field.data[marker_index, ...]
-
-    nuclei = _color_channel(layer_nuclei, (1, 0, 0), "uint8")
-    marker = _color_channel(layer_marker, (0, 1, 0), "uint8")
+    nuclei = rescale_intensity(field.channel(nuclei_index), out_range="uint8")
+    marker = rescale_intensity(field.channel(marker_index), out_range="uint8")
 
-    res = cv2.addWeighted(marker, 1, nuclei, 0.5, 0)
+    # The BGR planes are interleaved in one pass: half the nuclei in blue, rounded
+    # like cv2.addWeighted, and the marker in green
+    res = cv2.merge((cv2.convertScaleAbs(nuclei, alpha=0.5), marker, np.zeros_like(marker)))
     res = cv2.putText(
         res,
         f"{field.name} {marker_index}",
@@ -223,14 +237,8 @@ def visualisation(background: np.ndarray,
     if not centrioles or not nuclei:
         return background
 
-    it = np.nditer(assigned, flags=['multi_index'])
-    for entry in it:
-        if not entry:
-            continue
-        n, c = it.multi_index
-        nucleus = nuclei[n]
-        centriole = centrioles[c]
-        cv2.arrowedLine(background, tuple(reversed(centriole.centre)), tuple(reversed(nucleus.centre)),
+    for n, c in np.argwhere(assigned):
+        cv2.arrowedLine(background, centrioles[c].centre_xy, nuclei[n].centre_xy,
                         color=(0, 255, 0), thickness=2)
 
     return background
@@ -4,11 +4,10 @@ from pathlib import Path
 import numpy as np
 import pandas as pd
 from spotipy.utils import points_matching
-from stardist.models import StarDist2D
 from tqdm import tqdm
 
 from cenfind.core.data import Dataset
-from cenfind.core.detectors import extract_nuclei
+from cenfind.core.detectors import extract_nuclei, get_stardist
 from cenfind.constants import datasets
 
 PREFIX_REMOTE = Path("/data1/centrioles/canonical")
@@ -17,7 +16,7 @@ logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(asctime)s: %(m
 
 
 def main():
-    model_stardist = StarDist2D.from_pretrained('2D_versatile_fluo')
+    model_stardist = get_stardist('2D_versatile_fluo')
     accuracies = []
     preds = []
     actual = []
@@ -10,8 +10,8 @@ matplotlib.rc('font', **font)
 
 matplotlib.use("Agg")
 
-def extract_info(pattern: re, dataset_name: str):
-    res = re.match(pattern, dataset_name)
+def extract_info(pattern: re.Pattern, dataset_name: str):
+    res = pattern.match(dataset_name)
     res_dict = res.groupdict()
     markers = res_dict['markers'].split('+')
     res_dict['markers'] = tuple(markers)
@@ -12,6 +12,10 @@ from cenfind.core.data import Dataset
 
 config = dotenv_values(".env")
 
+pattern_extension = re.compile(r"\.[^.]+$")
+pattern_channel_extension = re.compile(r"C\d\.[^.]+$")
+
+
 def register_parser(parent_subparsers):
     parser = parent_subparsers.add_parser(
         "uploadmal",
@@ -87,12 +91,11 @@ def main():
         projection_suffix = ""
         dataset = Dataset(path_dataset)
         external_name = label.data.external_id
-        extension = external_name.split(".")[-1]
 
         print("Processing %s / %s" % (path_dataset, external_name))
 
         if centrioles:
-            annotation_name = re.sub(f".{extension}$", ".txt", external_name)
+            annotation_name = pattern_extension.sub(".txt", external_name)
             dst_centrioles = dataset.annotations / "centrioles" / annotation_name
             try:
                 positions = download_centrioles(label)
@@ -109,9 +112,7 @@ def main():
                 continue
 
         if nuclei:
-            mask_name = re.sub(
-                f"C\d\.{extension}$", f"{projection_suffix}_C0.tif", external_name
-            )
+            mask_name = pattern_channel_extension.sub(f"{projection_suffix}_C0.tif", external_name)
             dst_nuclei = dataset.annotations / "cells" / mask_name
             try:
                 mask = download_mask(label, "Nucleus")
@@ -4,10 +4,10 @@ from pathlib import Path
 import logging
 import numpy as np
 import pandas as pd
-import tifffile as tf
 
 from cenfind.core.data import Dataset, Field
 from cenfind.core.loading import load_foci
+from cenfind.core.serialise import save_visualisation
 from cenfind.core.visualisation import visualisation, create_vignette
 from cenfind.core.statistics import evaluate
 
@@ -66,26 +66,34 @@ def run(args):
     path_visualisation_model = dataset.visualisation / args.model.name
     path_visualisation_model.mkdir(exist_ok=True)
 
-    from cenfind.core.detectors import extract_foci, extract_nuclei
+    from cenfind.core.detectors import extract_foci_batch, extract_nuclei
 
     perfs = []
     with open(dataset.path / "test.txt", "r") as f:
         pairs = [l.strip("\n").split(",") for l in f.readlines()]
 
+    # The channels of a field go through SpotNet as one batch and share the nuclei
+    fields_channels = {}
     for field_name, channel in pairs:
-        channel = int(channel)
+        fields_channels.setdefault(field_name, []).append(int(channel))
+
+    for field_name, channels in fields_channels.items():
         field = Field(dataset.projections / f"{field_name}.tif")
-        annotation = load_foci(dataset.annotations / "centrioles" / f"{field.name}_C{channel}.txt")
-        predictions = extract_foci(field, channel, args.model, prob_threshold=args.threshold)
+        foci = extract_foci_batch([(field, channel) for channel in channels], args.model,
+                                  prob_threshold=args.threshold)
         nuclei = extract_nuclei(field, args.channel_nuclei)
 
-        for tol in tolerances:
-            logger.info("Processing %s %s %s" % (field, channel, tol))
-            perf = evaluate(field, channel, annotation, predictions, tol, threshold=args.threshold)
+        for channel, predictions in zip(channels, foci):
+            annotation = load_foci(dataset.annotations / "centrioles" / f"{field.name}_C{channel}.txt")
+            for tol in tolerances:
+                logger.info("Processing %s %s %s" % (field, channel, tol))
+                perf = evaluate(field, channel, annotation, predictions, tol, threshold=args.threshold)
+                perfs.append(perf)
+
+            # The predictions do not depend on the tolerance, so they are drawn once
             background = create_vignette(field, marker_index=channel, nuclei_index=args.channel_nuclei)
             vis = visualisation(background=background, centrioles=predictions, nuclei=nuclei)
-            tf.imwrite(path_visualisation_model / f"{field.name}_C{channel}_pred.png", vis)
-            perfs.append(perf)
+            save_visualisation(path_visualisation_model / f"{field.name}_C{channel}_pred.png", vis)
 
     performance_df = pd.DataFrame(perfs)
     performance_df = performance_df.set_index("field")
@@ -1,9 +1,8 @@
 import argparse
 from pathlib import Path
 
-import tifffile as tf
-
 from cenfind.core.data import Dataset
+from cenfind.core.serialise import save_visualisation
 from cenfind.core.visualisation import visualisation
 from cenfind.core.log import get_logger
 
@@ -35,15 +34,19 @@ def run(args):
 
     from cenfind.core.detectors import extract_foci, extract_nuclei
     pairs = dataset.splits()
+    # The nuclei channel is shared by all the channels of a field
+    nuclei_fields = {}
     for field, channel in pairs["test"]:
-        nuclei = extract_nuclei(field=field, channel=args.channel_nuclei)
+        if field.name not in nuclei_fields:
+            nuclei_fields[field.name] = extract_nuclei(field=field, channel=args.channel_nuclei)
+        nuclei = nuclei_fields[field.name]
         foci = extract_foci(field, channel, args.model, prob_threshold=0.5)
         logger.info(
             "Writing visualisation for field: %s, channel: %s, %s foci detected"
             % (field.name, channel, len(foci))
         )
         vis = visualisation(field, channel_centrioles=channel, channel_nuclei=args.channel_nuclei, nuclei=nuclei)
-        tf.imwrite(model_run / f"{field.name}_C{channel}_pred.png", vis)
+        save_visualisation(model_run / f"{field.name}_C{channel}_pred.png", vis)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,23 @@
+import cv2
+
+
+def random_contours(rng, num_contours, size=100, min_points=1):
+    """
+    Traces the outer contours of random blob masks.
+
+    Args:
+        rng: Numpy random generator
+        num_contours: Number of contours to return
+        size: Side of the square masks
+        min_points: Minimal number of points of the returned contours
+
+    Returns: List of contours (N x 1 x 2, XY)
+
+    """
+    contours = []
+    while len(contours) < num_contours:
+        blobs = (rng.random((size // 10, size // 10)) > 0.5).astype("uint8")
+        mask = cv2.resize(blobs, (size, size), interpolation=cv2.INTER_NEAREST)
+        found, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        contours.extend(c for c in found if len(c) >= min_points)
+    return contours[:num_contours]
@@ -0,0 +1,100 @@
+import cv2
+import numpy as np
+import tifffile
+from csbdeep.utils import normalize
+from spotipy.utils import normalize_fast2d
+
+from cenfind.core.data import Field
+from cenfind.core.detectors import _nearest_indices, extract_nuclei, normalize_percentiles
+from cenfind.core.visualisation import resize_image
+
+
+def random_plane(shape, dtype="uint16", seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.gamma(2.0, 400.0, size=shape).clip(0, np.iinfo(dtype).max).astype(dtype)
+
+
+def test_normalize_percentiles_foci():
+    # The first plane goes through the lookup table, the second one is below the table size
+    for shape in [(512, 512), (128, 128)]:
+        plane = random_plane(shape)
+        expected = normalize_fast2d(plane, pmin=1, pmax=99.8, sub=4)
+        result = normalize_percentiles(plane, pmin=1, pmax=99.8, sub=4)
+        assert result.dtype == np.float32
+        assert np.allclose(result, expected, rtol=1e-6, atol=1e-6)
+
+
+def test_normalize_percentiles_nuclei():
+    for shape in [(512, 512), (128, 128)]:
+        plane = random_plane(shape, seed=1)
+        expected = normalize(plane, pmin=3, pmax=99.8)
+        result = normalize_percentiles(plane, pmin=3, pmax=99.8)
+        assert result.dtype == np.float32
+        assert np.allclose(result, expected, rtol=1e-6, atol=1e-6)
+
+
+def test_normalize_percentiles_out():
+    plane = random_plane((512, 512), dtype="uint8")
+    out = np.zeros((520, 520), dtype=np.float32)
+    result = normalize_percentiles(plane, out=out[4:516, 4:516])
+    assert np.shares_memory(result, out)
+    assert np.allclose(out[4:516, 4:516], normalize_percentiles(plane.astype(np.float32)), rtol=1e-6, atol=1e-6)
+    assert not out[:4].any()
+
+
+def test_nearest_indices_match_resize():
+    for src_size, dst_size in [(512, 2048), (512, 2000), (300, 2048), (7, 20)]:
+        source = np.arange(src_size, dtype=np.float32)[None, :]
+        resized = cv2.resize(source, dsize=(dst_size, 1), interpolation=cv2.INTER_NEAREST)
+        assert np.array_equal(_nearest_indices(src_size, dst_size), resized[0].astype(int))
+
+
+class StubStarDist:
+    """
+    Stands in for StarDist and labels a grid of ellipses on an image of the input shape.
+    """
+
+    def __init__(self, empty=False):
+        self.empty = empty
+
+    def predict_instances(self, image, n_tiles=None):
+        labels = np.zeros(image.shape, dtype=np.int32)
+        if self.empty:
+            return labels, {}
+        rng = np.random.default_rng(0)
+        height, width = image.shape
+        cell = 48
+        index = 1
+        for row in range(cell // 2, height - cell // 2, cell):
+            for col in range(cell // 2, width - cell // 2, cell):
+                axes = tuple(int(v) for v in rng.integers(6, cell // 2 - 2, size=2))
+                cv2.ellipse(labels, (col, row), axes, int(rng.integers(0, 180)), 0, 360, index, -1)
+                index += 1
+        return labels, {}
+
+
+def write_field(path, shape):
+    data = np.random.default_rng(0).integers(0, 4000, size=(2,) + shape, dtype=np.uint16)
+    tifffile.imwrite(path, data)
+    return Field(path)
+
+
+def test_nucleus_contours_match_full_upsample(tmp_path):
+    model = StubStarDist()
+    for shape in [(512, 512), (1024, 768), (600, 500)]:
+        field = write_field(tmp_path / f"field_{shape[0]}x{shape[1]}.tif", shape)
+        nuclei = extract_nuclei(field, 0, model=model)
+
+        labels, _ = model.predict_instances(resize_image(field.channel(0)))
+        full = cv2.resize(labels, dsize=shape[::-1], interpolation=cv2.INTER_NEAREST)
+        assert full.shape == shape
+        assert len(nuclei) == labels.max() > 0
+        for nucleus in nuclei:
+            expected, _ = cv2.findContours((full == nucleus.index + 1).astype("uint8"), cv2.RETR_EXTERNAL,
+                                           cv2.CHAIN_APPROX_SIMPLE)
+            assert np.array_equal(nucleus.contour, expected[0])
+
+
+def test_extract_nuclei_empty(tmp_path):
+    field = write_field(tmp_path / "field.tif", (512, 512))
+    assert extract_nuclei(field, 0, model=StubStarDist(empty=True)) == []
@@ -0,0 +1,84 @@
+import itertools
+
+import cv2
+import numpy as np
+
+from cenfind.core.measure import Assigner, signed_distances
+from cenfind.core.structures import Centriole, Nucleus
+
+from .conftest import random_contours
+
+
+def random_field(rng, num_nuclei, num_centrioles, size=100):
+    nuclei = []
+    for index in range(num_nuclei):
+        centre = tuple(int(v) for v in rng.integers(20, size - 20, size=2))
+        axes = tuple(int(v) for v in rng.integers(5, 20, size=2))
+        angle = int(rng.integers(0, 180))
+        contour = cv2.ellipse2Poly(centre, axes, angle, 0, 360, 10).reshape(-1, 1, 2)
+        nuclei.append(Nucleus(field=None, channel=0, contour=contour, index=index))
+    centrioles = [Centriole(field=None, channel=1, centre=tuple(int(v) for v in rng.integers(0, size, size=2)),
+                            index=index)
+                  for index in range(num_centrioles)]
+    return centrioles, nuclei
+
+
+def test_signed_distances_match_point_polygon_test():
+    rng = np.random.default_rng(1)
+    for _ in range(20):
+        contours = random_contours(rng, 4, min_points=3)
+        nuclei = [Nucleus(field=None, channel=0, contour=contour, index=index)
+                  for index, contour in enumerate(contours)]
+
+        vertices = np.concatenate([c.reshape(-1, 2) for c in contours])
+        ends = np.concatenate([np.roll(c.reshape(-1, 2), -1, axis=0) for c in contours])
+        # One pixel along each horizontal or vertical edge longer than a pixel
+        steps = ends - vertices
+        straight = (steps == 0).any(axis=1) & (np.abs(steps).max(axis=1) > 1)
+        edges = vertices[straight] + np.sign(steps[straight])
+        outside = rng.integers(-30, 130, size=(40, 2))
+        inside = rng.integers(0, 100, size=(40, 2))
+        points_xy = np.concatenate([vertices, edges, outside, inside])
+        centrioles = [Centriole(field=None, channel=1, centre=(int(y), int(x)), index=index)
+                      for index, (x, y) in enumerate(points_xy)]
+
+        expected = np.array([[cv2.pointPolygonTest(contour, (int(x), int(y)), True) for x, y in points_xy]
+                             for contour in contours])
+        result = signed_distances(centrioles, nuclei)
+
+        assert result.shape == (len(nuclei), len(centrioles))
+        assert np.allclose(result, expected)
+        assert (result[expected == 0] == 0).all()
+
+
+def test_signed_distances_empty():
+    contour = np.array([[[0, 0]], [[10, 0]], [[10, 10]], [[0, 10]]])
+    nuclei = [Nucleus(field=None, channel=0, contour=contour)]
+    assert signed_distances([], nuclei).shape == (1, 0)
+    assert signed_distances([Centriole(field=None, channel=1, centre=(5, 5))], []).shape == (0, 1)
+
+
+def brute_force(centrioles, nuclei, vicinity):
+    costs = np.array([[cv2.pointPolygonTest(n.contour, c.centre[::-1], True) + vicinity for c in centrioles]
+                      for n in nuclei])
+    best = 0
+    for choice in itertools.product(range(-1, len(nuclei)), repeat=len(centrioles)):
+        value = sum(costs[n, c] for c, n in enumerate(choice) if n >= 0)
+        best = max(best, value)
+    return costs, best
+
+
+def test_assignment_matches_brute_force():
+    rng = np.random.default_rng(0)
+    for _ in range(50):
+        num_nuclei = int(rng.integers(1, 4))
+        num_centrioles = int(rng.integers(1, 6))
+        vicinity = float(rng.integers(-10, 30))
+        centrioles, nuclei = random_field(rng, num_nuclei, num_centrioles)
+
+        assignment = Assigner(centrioles, nuclei, vicinity=vicinity)._compute(vicinity)
+        costs, best = brute_force(centrioles, nuclei, vicinity)
+
+        assert assignment.shape == (num_nuclei, num_centrioles)
+        assert (assignment.sum(axis=0) <= 1).all()
+        assert np.isclose(costs[assignment].sum(), best)
@@ -0,0 +1,28 @@
+import numpy as np
+import pandas as pd
+import tifffile
+
+from cenfind.core.data import Field
+from cenfind.core.serialise import save_points
+from cenfind.core.structures import Centriole
+
+
+def test_save_points_writes_every_point(tmp_path):
+    path = tmp_path / "field.tif"
+    data = np.arange(2 * 32 * 32, dtype=np.uint16).reshape(2, 32, 32)
+    tifffile.imwrite(path, data)
+    field = Field(path)
+
+    # Cilia are all created with the default index
+    centres = [(5, 5), (10, 20), (30, 3)]
+    cilia = [Centriole(field=field, channel=1, centre=centre, label="Cilium") for centre in centres]
+
+    dst = tmp_path / "cilia.tsv"
+    save_points(dst, cilia)
+    result = pd.read_csv(dst, sep="\t")
+
+    assert list(result.columns) == ["channel", "pos_r", "pos_c", "intensity"]
+    assert len(result) == len(cilia)
+    assert result[["pos_r", "pos_c"]].values.tolist() == [list(c) for c in centres]
+    assert result["intensity"].tolist() == [c.as_dict()["intensity"] for c in cilia]
+
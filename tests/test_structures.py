@@ -0,0 +1,42 @@
+import cv2
+import numpy as np
+
+from cenfind.core.structures import Nucleus, _contour_stats
+
+from .conftest import random_contours
+
+
+def check_contour(contour):
+    row_min, col_min, row_max, col_max, area, m10, m01 = _contour_stats(contour)
+    x, y, w, h = cv2.boundingRect(contour)
+    assert (row_min, col_min, row_max, col_max) == (y, x, y + h - 1, x + w - 1)
+
+    assert np.isclose(area, cv2.contourArea(contour, oriented=True))
+
+    moments = cv2.moments(contour)
+    sign = -1 if area < 0 else 1
+    assert np.isclose(sign * area, moments["m00"])
+    assert np.isclose(sign * m10, moments["m10"])
+    assert np.isclose(sign * m01, moments["m01"])
+
+    nucleus = Nucleus(field=None, channel=0, contour=contour)
+    centre_x = int(moments["m10"] / (moments["m00"] + 1e-5))
+    centre_y = int(moments["m01"] / (moments["m00"] + 1e-5))
+    assert nucleus.centre == (centre_y, centre_x)
+    assert nucleus.area == int(cv2.contourArea(contour))
+
+
+def test_contour_stats_match_opencv():
+    rng = np.random.default_rng(0)
+    for contour in random_contours(rng, 100):
+        check_contour(contour)
+
+
+def test_contour_stats_degenerate():
+    point = np.array([[[5, 7]]], dtype=np.int32)
+    segment = np.array([[[5, 7]], [[12, 7]]], dtype=np.int32)
+    collinear = np.array([[[0, 0]], [[3, 3]], [[6, 6]]], dtype=np.int32)
+    repeated = np.array([[[4, 4]], [[4, 4]], [[4, 4]]], dtype=np.int32)
+    for contour in (point, segment, collinear, repeated):
+        check_contour(contour)
+        assert _contour_stats(contour)[4] == 0